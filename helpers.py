@@ -0,0 +1,161 @@
+"""Backend and formatting helpers shared by the Streamlit entrypoint."""
+
+import importlib.util
+import json
+import time
+from html import escape
+from typing import TYPE_CHECKING, BinaryIO, Optional, Tuple
+
+import streamlit as st
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Fall back to the stdlib parser
+
+if TYPE_CHECKING:
+    import requests
+
+# requests (and urllib3, idna, charset_normalizer, ...) is imported on first use so
+# the first paint doesn't wait for it; find_spec only checks that it's installed.
+HAS_REQUESTS = importlib.util.find_spec("requests") is not None
+_MISSING_REQUESTS = "Python 'requests' package is not installed. Run: pip install -r requirements.txt"
+
+
+# Checked in order, so "non-glaucoma suspect" still reads as non-glaucoma
+_BADGE = {"non": "badge-green", "suspect": "badge-amber"}
+
+
+def classification_badge(text: str) -> str:
+    t = str(text or "").strip()
+    cls = next((c for k, c in _BADGE.items() if k in t.lower()), "badge-red")
+    return f'<span class="status-badge {cls}">{escape(t)}</span>'
+
+
+# The uploader only accepts these extensions, so a static table covers every input.
+_MIME = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg"}
+
+
+def infer_mime(filename: str) -> str:
+    return _MIME.get(filename.rsplit(".", 1)[-1].lower(), "application/octet-stream")
+
+
+@st.cache_resource
+def _session() -> "requests.Session":
+    """Pooled HTTP session so repeat analyses reuse the keep-alive (TLS) connection."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    # No adapter-level retries: post_predict's loop owns the retry policy for /predict.
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class _Unreachable(Exception):
+    """Raised inside the 60 s probe cache so only successes are kept that long."""
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _probe(base_url: str) -> bool:
+    import requests
+
+    try:
+        # Plain request without the session's status retries: the first reply decides.
+        resp = requests.head(base_url.rstrip("/") + "/health", timeout=(3, 3))
+    except requests.exceptions.RequestException:
+        raise _Unreachable
+    if resp.status_code >= 500 or "ngrok-error-code" in resp.headers:
+        raise _Unreachable
+    return True
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def probe_server(base_url: str) -> bool:
+    """Cheap reachability check so a stale ngrok URL or sleeping kernel fails fast.
+
+    Any answer from the app itself counts, including a 404/405 from a backend
+    without a /health route; 5xx responses and ngrok's own error pages do not.
+    Successes are cached for 60 s; failures only for 5 s, so reruns while the
+    server is down don't each wait on a new probe, yet a recovering server is
+    picked up quickly. probe_server.clear() forces an immediate re-check.
+    """
+    if not HAS_REQUESTS:
+        return False
+    try:
+        return _probe(base_url)
+    except _Unreachable:
+        return False
+
+
+# ngrok answers these while the Colab kernel is waking up. 504 is left out: it only
+# arrives after the upstream has already spent its time, so a retry would repeat that wait.
+_RETRY_STATUSES = frozenset({502, 503})
+
+
+def post_predict(
+    base_url: str,
+    uploaded_file: BinaryIO,
+    image_sha: Optional[str] = None,
+    timeout_s: Tuple[float, float] = (5, 120),
+    max_attempts: int = 3,
+) -> Tuple[Optional[dict], Optional[str]]:
+    """Call the backend /predict endpoint with the uploaded image.
+
+    The file handle is passed straight to requests, so the image is read from
+    the upload buffer instead of being copied into an intermediate BytesIO.
+
+    timeout_s is a (connect, read) pair: an unreachable URL fails fast while slow
+    inference is still tolerated. Connection failures and 502/503 responses are
+    retried with 2**attempt second backoff; read timeouts are not, since the server
+    may still be working.
+
+    image_sha, when given, is sent as a form field so the backend can reuse a
+    previous prediction for identical image content.
+
+    Returns: (json_data, error_message)
+    """
+    try:
+        import requests
+    except ImportError:
+        return None, _MISSING_REQUESTS
+
+    url = base_url.rstrip("/") + "/predict"
+    form = {"image_sha": image_sha} if image_sha else None
+    for attempt in range(max_attempts):
+        uploaded_file.seek(0)
+        files = {
+            "image": (uploaded_file.name, uploaded_file, infer_mime(uploaded_file.name)),
+        }
+        try:
+            resp = _session().post(url, data=form, files=files, timeout=timeout_s)
+        except requests.exceptions.ConnectionError as e:
+            if attempt == max_attempts - 1:
+                return None, f"Failed to reach server: {e}"
+            time.sleep(2**attempt)
+            continue
+        except requests.exceptions.RequestException as e:
+            return None, f"Failed to reach server: {e}"
+
+        if resp.status_code not in _RETRY_STATUSES or attempt == max_attempts - 1:
+            break
+        time.sleep(2**attempt)
+
+    try:
+        # Parse the raw body directly; skips requests' charset detection
+        data = orjson.loads(resp.content) if orjson is not None else json.loads(resp.content)
+    except ValueError:
+        data = None
+
+    if not resp.ok:
+        # Prefer server-provided error detail
+        if isinstance(data, dict) and data.get("error"):
+            return None, f"{data.get('error')}\nDetail: {data.get('detail', 'N/A')}"
+        return None, f"Server returned HTTP {resp.status_code}"
+
+    if not isinstance(data, dict):
+        return None, "Unexpected response from server (not JSON object)."
+
+    return data, None
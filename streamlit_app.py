@@ -1,15 +1,13 @@
+import hashlib
 import io
-import json
-import mimetypes
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Optional, Tuple
 
 import streamlit as st
 from html import escape
+from PIL import Image, ImageOps
 
-try:
-    import requests
-except ImportError:
-    requests = None  # We'll show a hint in the UI
+from helpers import HAS_REQUESTS, classification_badge, infer_mime, post_predict, probe_server
 
 
 # --------------------------
@@ -23,64 +21,18 @@ st.set_page_config(
 
 PRIMARY_URL_DEFAULT = "https://dominant-usually-oyster.ngrok-free.app"
 
-st.markdown(
-    """
-    <style>
-            /* Theme-aware tokens for card */
-            :root {
-                --card-bg: #ffffff;
-                --card-border: rgba(0,0,0,0.06);
-                --muted: #6b7280;
-                --fg: #111827; /* gray-900 */
-                --card-shadow: 0 1px 2px rgba(17,24,39,0.06), 0 4px 12px rgba(17,24,39,0.04);
-            }
-            @media (prefers-color-scheme: dark) {
-                :root {
-                    --card-bg: #111827; /* gray-900 */
-                    --card-border: #374151; /* gray-700 */
-                    --muted: #9CA3AF; /* gray-400 */
-                    --fg: #E5E7EB; /* gray-200 */
-                    --card-shadow: 0 1px 2px rgba(0,0,0,0.4);
-                }
-            }
-
-      .card {
-        padding: 1rem 1.25rem;
-                border: 1px solid var(--card-border);
-                border-radius: 12px;
-                                background: var(--card-bg);
-                                color: var(--fg);
-                                line-height: 1.5;
-        box-shadow: var(--card-shadow);
-      }
-        .card p { margin: 0.35rem 0 0; }
-        .card-grid {
-            display: flex;
-            gap: 1rem;
-            align-items: flex-start;
-            justify-content: space-between;
-        }
-        .card-left { flex: 2; min-width: 0; }
-        .card-right { flex: 1; text-align: right; }
-      .status-badge {
-        display: inline-block;
-        padding: 0.35rem 0.65rem;
-        border-radius: 999px;
-        font-weight: 600;
-        font-size: 0.9rem;
-      }
-      .badge-green { background: #DCFCE7; color: #166534; }
-      .badge-red { background: #FEE2E2; color: #991B1B; }
-      .badge-amber { background: #FEF3C7; color: #92400E; }
-                        .subtle { color: var(--muted); }
-      .mono { font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace; }
-                        .kpi .label { color: var(--muted); font-size: 0.85rem; margin-bottom: 0.25rem; }
-            .kpi .value { font-size: 1.5rem; font-weight: 700; }
-
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+# Served from ./static via [server] enableStaticServing in .streamlit/config.toml
+CSS_HREF = "app/static/card.css"
+
+
+@st.cache_resource
+def _inject_css() -> None:
+    # Built once per process; Streamlit replays the cached element on later reruns.
+    # Only the <link> tag travels over the websocket; the browser caches the file.
+    st.markdown(f'<link rel="stylesheet" href="{CSS_HREF}">', unsafe_allow_html=True)
+
+
+_inject_css()
 
 
 # --------------------------
@@ -95,6 +47,10 @@ with st.sidebar:
     )
     st.session_state["server_url"] = server_url.strip()
 
+    # Filled in after the title and uploader render; the probe itself still runs
+    # before the Analyze button, which it enables.
+    server_status = st.empty()
+
     st.caption(
         "Backend must expose POST /predict accepting form-data file under key 'image' and return JSON with classification, detail, ratio, and annotated_image_url."
     )
@@ -103,56 +59,132 @@ with st.sidebar:
 # --------------------------
 # Helpers
 # --------------------------
-def classification_badge(text: str) -> str:
-    t = (text or "").lower().strip()
-    if "non" in t:
-        cls = "badge-green"
-    elif "suspect" in t:
-        cls = "badge-amber"
-    else:
-        cls = "badge-red"
-    return f'<span class="status-badge {cls}">{text}</span>'
+@st.cache_resource
+def _executor() -> ThreadPoolExecutor:
+    """Shared worker pool so backend calls can run while the UI renders."""
+    return ThreadPoolExecutor(max_workers=4)
 
 
-def infer_mime(filename: str) -> str:
-    mime, _ = mimetypes.guess_type(filename)
-    return mime or "application/octet-stream"
+def _shrink(file_bytes: bytes, max_side: int = 1024) -> Tuple[bytes, str]:
+    """Downscale large images before upload; the backend never needs more than max_side px.
+
+    Images that already fit are sent untouched. Not cached itself: its only caller,
+    _cached_predict, is already memoized per file hash. Returns: (image_bytes, mime)
+    """
+    im = Image.open(io.BytesIO(file_bytes))
+    if max(im.size) <= max_side:
+        return file_bytes, Image.MIME.get(im.format, "application/octet-stream")
+
+    im = ImageOps.exif_transpose(im).convert("RGB")
+    im.thumbnail((max_side, max_side), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=90, optimize=True)
+    return buf.getvalue(), "image/jpeg"
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _thumb(file_id: str, _file_bytes: bytes, max_side: int = 512) -> bytes:
+    """Small JPEG preview, shared by every st.image call that shows the upload.
+
+    Paired with output_format="JPEG" so st.image passes the bytes through as-is.
+    Keyed on the upload's file_id so reruns don't re-hash the full image bytes.
+    """
+    im = ImageOps.exif_transpose(Image.open(io.BytesIO(_file_bytes))).convert("RGB")
+    im.thumbnail((max_side, max_side), Image.LANCZOS)
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=90, optimize=True)
+    return buf.getvalue()
+
 
+class _PredictError(Exception):
+    """Raised inside the cached call so failed requests are never memoized."""
 
-def post_predict(
-    base_url: str, file_name: str, file_bytes: bytes, timeout_s: int = 120
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def _cached_predict(base_url: str, file_hash: str, file_name: str, _file_bytes: bytes) -> dict:
+    # _file_bytes is excluded from Streamlit's argument hashing; file_hash is the key.
+    body, mime = _shrink(_file_bytes)
+    if mime != infer_mime(file_name):
+        file_name = file_name.rsplit(".", 1)[0] + ".jpg"
+    buf = io.BytesIO(body)
+    buf.name = file_name
+    data, err = post_predict(base_url, buf, image_sha=file_hash)
+    if err:
+        raise _PredictError(err)
+    return data
+
+
+def cached_predict(
+    base_url: str, file_hash: str, file_name: str, file_bytes: bytes
 ) -> Tuple[Optional[dict], Optional[str]]:
-    """Call the backend /predict endpoint with the uploaded image.
+    """Like post_predict, but repeat analyses of the same image are served from cache.
 
     Returns: (json_data, error_message)
     """
-    if requests is None:
-        return None, "Python 'requests' package is not installed. Run: pip install -r requirements.txt"
-
-    url = base_url.rstrip("/") + "/predict"
-    files = {
-        "image": (file_name, io.BytesIO(file_bytes), infer_mime(file_name)),
-    }
     try:
-        resp = requests.post(url, files=files, timeout=timeout_s)
-    except requests.exceptions.RequestException as e:
-        return None, f"Failed to reach server: {e}"
+        return _cached_predict(base_url, file_hash, file_name, file_bytes), None
+    except _PredictError as e:
+        return None, str(e)
 
+
+@st.fragment
+def _render_results(data: dict, preview: Optional[bytes]) -> None:
+    """Results panel; runs as a fragment so its own interactions don't rerun the page."""
+    # Expect keys: classification, detail, ratio, annotated_image_url
+    classification = data.get("classification") or data.get("final_classification")
+    detail = data.get("detail") or data.get("details")
+    ratio = data.get("ratio") or data.get("cdr")
+    annotated_url = data.get("annotated_image_url")
+
+    # Normalize ratio
     try:
-        data = resp.json()
+        ratio_val = float(ratio) if ratio is not None else None
     except Exception:
-        data = None
+        ratio_val = None
+    # Prepare ratio text: prefer numeric to 2 decimals; else raw string; else em dash
+    ratio_text = f"{ratio_val:.2f}" if ratio_val is not None else (str(ratio).strip() if ratio not in (None, "", []) else "—")
+
+    st.subheader("Results")
+
+    # Top summary card
+    st.markdown(
+        f"""
+        <div class="card">
+            <div class="card-grid">
+                <div class="card-left">
+                    <div>Classification: {classification_badge(classification or 'Unknown')}</div>
+                    {f"<p>{escape(str(detail))}</p>" if detail else ""}
+                </div>
+                <div class="card-right">
+                    <div class="kpi">
+                        <div class="label">Cup-to-Disc Ratio</div>
+                        <div class="value">{escape(ratio_text)}</div>
+                    </div>
+                </div>
+            </div>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
 
-    if not resp.ok:
-        # Prefer server-provided error detail
-        if isinstance(data, dict) and data.get("error"):
-            return None, f"{data.get('error')}\nDetail: {data.get('detail', 'N/A')}"
-        return None, f"Server returned HTTP {resp.status_code}"
+    st.divider()
 
-    if not isinstance(data, dict):
-        return None, "Unexpected response from server (not JSON object)."
+    # Visualizations: Annotated vs Original
+    a_col, b_col = st.columns(2)
+    with a_col:
+        st.subheader("Annotated image")
+        if isinstance(annotated_url, str) and annotated_url.startswith("http"):
+            st.image(annotated_url, caption="Server-provided annotation", width="stretch")
+        else:
+            st.warning("Annotated image not available from server.")
 
-    return data, None
+    with b_col:
+        st.subheader("Original image (repeated)")
+        if preview is not None:
+            st.image(preview, width="stretch", output_format="JPEG")
+
+    with st.expander("Advanced • Raw response"):
+        st.json(data)
 
 
 # --------------------------
@@ -165,97 +197,82 @@ uploaded = st.file_uploader(
     "Upload fundus image", type=["png", "jpg", "jpeg"], accept_multiple_files=False
 )
 
+server_ok = bool(server_url.strip()) and probe_server(server_url.strip())
+with server_status.container():
+    if server_ok:
+        st.markdown("<span class='status-badge badge-green'>● Server reachable</span>", unsafe_allow_html=True)
+    else:
+        st.markdown("<span class='status-badge badge-red'>● Server unreachable</span>", unsafe_allow_html=True)
+        # Drop the short negative cache so the rerun from this click probes again
+        st.button("Re-check server", on_click=probe_server.clear)
+
 analyze_col, info_col = st.columns([1, 2])
 with analyze_col:
-    analyze = st.button("🔍 Analyze", type="primary", disabled=uploaded is None)
+    analyze = st.button(
+        "🔍 Analyze",
+        type="primary",
+        disabled=uploaded is None or not server_ok,
+        help=None if server_ok else "Server is unreachable; check the Colab Server URL in the sidebar.",
+    )
 with info_col:
     st.write("")
     st.markdown("<span class='subtle'>Accepted formats: PNG, JPG. Typical processing time: a few seconds.</span>", unsafe_allow_html=True)
 
+# Start the backend call right away so the previews below render while it is in flight
+predict_future = None
+if analyze and uploaded is not None and server_url:
+    raw_bytes = uploaded.getvalue()
+    file_hash = hashlib.blake2b(raw_bytes, digest_size=16).hexdigest()
+    predict_future = _executor().submit(
+        cached_predict, server_url, file_hash, uploaded.name, raw_bytes
+    )
+
 left, right = st.columns(2)
 
+preview = None
 if uploaded is not None:
     # Show original preview
+    preview = _thumb(uploaded.file_id, uploaded.getvalue())
     with left:
         st.subheader("Original image")
-        st.image(uploaded, caption=uploaded.name, use_container_width=True)
+        st.image(preview, caption=uploaded.name, width="stretch", output_format="JPEG")
 
 result_container = st.container()
 
 if analyze and uploaded is not None:
-    if not server_url:
+    if predict_future is None:
         st.error("Please provide a valid Colab Server URL in the sidebar.")
     else:
-        with st.spinner("Contacting Glaucoma Agent…"):
-            raw_bytes = uploaded.getvalue()
-            data, err = post_predict(server_url, uploaded.name, raw_bytes)
+        with st.status("Uploading image…", expanded=True) as status:
+            st.write(f"Sending {uploaded.name} to the Glaucoma Agent…")
+            # requests reports no upload/inference boundary, so only say the call is still pending
+            if not wait([predict_future], timeout=2).done:
+                status.update(label="Waiting for the server…")
+                st.write("Still waiting for the server's response…")
+            data, err = predict_future.result()
+            if err:
+                status.update(label="Analysis failed", state="error", expanded=False)
+            else:
+                status.update(label="Analysis complete", state="complete", expanded=False)
 
         if err:
+            st.session_state.pop("last_result", None)
             st.error(err)
         else:
-            # Expect keys: classification, detail, ratio, annotated_image_url
-            classification = data.get("classification") or data.get("final_classification")
-            detail = data.get("detail") or data.get("details")
-            ratio = data.get("ratio") or data.get("cdr")
-            annotated_url = data.get("annotated_image_url")
-
-            # Normalize ratio
-            try:
-                ratio_val = float(ratio) if ratio is not None else None
-            except Exception:
-                ratio_val = None
-            # Prepare ratio text: prefer numeric to 2 decimals; else raw string; else em dash
-            ratio_text = f"{ratio_val:.2f}" if ratio_val is not None else (str(ratio).strip() if ratio not in (None, "", []) else "—")
-
-            with result_container:
-                st.subheader("Results")
-
-                                # Top summary card
-                st.markdown(
-                        f"""
-                        <div class="card">
-                            <div class="card-grid">
-                                <div class="card-left">
-                                    <div>Classification: {classification_badge(classification or 'Unknown')}</div>
-                                    {f"<p>{escape(str(detail))}</p>" if detail else ""}
-                                </div>
-                                <div class="card-right">
-                                    <div class="kpi">
-                                        <div class="label">Cup-to-Disc Ratio</div>
-                                        <div class="value">{escape(ratio_text)}</div>
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                        """,
-                        unsafe_allow_html=True,
-                )
-
-                st.divider()
-
-                # Visualizations: Annotated vs Original
-                a_col, b_col = st.columns(2)
-                with a_col:
-                    st.subheader("Annotated image")
-                    if isinstance(annotated_url, str) and annotated_url.startswith("http"):
-                        st.image(annotated_url, caption="Server-provided annotation", use_container_width=True)
-                    else:
-                        st.warning("Annotated image not available from server.")
-
-                with b_col:
-                    st.subheader("Original image (repeated)")
-                    if uploaded is not None:
-                        st.image(uploaded, use_container_width=True)
-
-                with st.expander("Advanced • Raw response"):
-                    st.json(data)
+            # Keep the result around so later reruns redraw it without calling the backend
+            st.session_state["last_result"] = (uploaded.file_id, data)
 
 elif uploaded is None:
     st.info("Upload a fundus image to begin.")
 
+last_result = st.session_state.get("last_result")
+if uploaded is not None and last_result and last_result[0] == uploaded.file_id:
+    with result_container:
+        _render_results(last_result[1], preview)
+
 
 # Guidance when requests isn't available
-if requests is None:
+if not HAS_REQUESTS:
     st.warning(
         "'requests' package not found. Please run `pip install -r requirements.txt` and restart the app.",
         icon="⚠️",